@@ -1,14 +1,39 @@
 import serial
 import time
-import csv
 import os
 import sys # Import sys for exit
+import signal
+import queue
+import threading
+import scpi
 
 # --- Configuration ---
 port = '/dev/cu.usbmodemT0415C223200611' # <<< CHECK/UPDATE YOUR SERIAL PORT
 baud_rate = 115200
 integration_interval_seconds = 10 # <<< SET YOUR DESIRED INTEGRATION TIME HERE (seconds)
 output_csv_file = f"power_data_integrated_{integration_interval_seconds}s.csv" # Dynamic filename in script directory
+# CSV row layout: Timestamp, Avg P, Wh, V+pk, I, Inst P (fixed precision, CRLF like the csv module), bound once
+csv_row_format = "{},{:.4f},{:.6f},{:.4f},{:.4f},{:.4f}\r\n".format
+DEBUG_CONFIRM = False # Set True to read back and print instrument settings after configuration
+
+# --- Pre-encoded integration SCPI commands (sent every cycle, so encode once) ---
+CMD_RESET = b":INTegrate:RESet\n"          # Set command (mixed case)
+CMD_STATE = b":INTEGRATE:STATE?\n"         # Query command (ALL CAPS), used by the polling fallback
+# Start and ask for *OPC?; the "1" reply is expected once the timed integration ends. *OPC? (unlike *WAI)
+# does not hold the parser, so a STOP sent during cleanup is still executed immediately.
+CMD_START = b":INTegrate:STARt;*OPC?\n"
+# State and values in one round-trip; the instrument answers with one line: "<state>;<v1>,<v2>,<v3>,<v4>"
+CMD_STATE_AND_READ = b":INTEGRATE:STATE?;:NUMERIC:NORMAL:VALUE?\n"
+CMD_STOP = b":INTegrate:STOP\n"            # Set command (mixed case)
+
+# --- Integration state token (STATE? response with any header stripped, e.g. ":INTEGRATE:STATE TIM") -> action ---
+# Tokens not listed map to "unknown", which means keep waiting (same as the original polling loop)
+STATE_MAP = {
+    "TIM": "done", "TIMEUP": "done",
+    "RUN": "run", "RUNNING": "run",
+    "STOP": "stop", "RESET": "stop",
+    "OVERFLOW": "err",
+}
 
 # --- Initialize Serial Connection Variable ---
 ser = None
@@ -23,45 +48,86 @@ def seconds_to_hms(seconds):
     h = min(h, 9999)
     return int(h), int(m), int(s)
 
-# --- Function to safely write to serial and handle potential errors ---
-def safe_serial_write(ser_conn, command):
-    """Sends a command to the serial port and handles potential write errors."""
-    try:
-        # print(f"SEND: {command.strip()}") # Uncomment for debugging writes
-        ser_conn.write(command.encode())
-        time.sleep(0.1) # Small delay after write seems necessary for some devices
-        return True
-    except serial.SerialTimeoutException:
-        print(f"Error: Serial write timeout sending command: {command.strip()}")
-        return False
-    except serial.SerialException as e:
-        print(f"Error: Serial write error sending command: {command.strip()} - {e}")
-        return False
-    except Exception as e:
-        print(f"Error: Unexpected error sending command: {command.strip()} - {e}")
-        return False
-
-# --- Function to safely read from serial ---
-def safe_serial_read(ser_conn):
-    """Reads a line from the serial port, handling potential errors and timeouts."""
-    try:
-        response_bytes = ser_conn.readline()
-        if response_bytes:
-            response_str = response_bytes.decode().strip()
-            # print(f"RECV: {response_str}") # Uncomment for debugging reads
-            return response_str
+# --- Interval constants derived once from the configuration ---
+TIMER_H, TIMER_M, TIMER_S = seconds_to_hms(integration_interval_seconds)
+TIMER_CMD = f":INTegrate:TIMer {TIMER_H},{TIMER_M},{TIMER_S}" # Set command (mixed case)
+INTERVAL_HOURS = integration_interval_seconds / 3600.0
+INV_INTERVAL_HOURS = 1.0 / INTERVAL_HOURS if INTERVAL_HOURS > 1e-9 else 0.0 # Avoid division by zero or near-zero
+
+# --- Signal handler so SIGTERM runs the same cleanup (drain CSV queue/close) as Ctrl+C ---
+def handle_termination_signal(signum, frame):
+    """Converts SIGTERM into KeyboardInterrupt so the finally block writes queued rows and closes files."""
+    raise KeyboardInterrupt
+
+# --- Background CSV writer so disk stalls never delay the next integration cycle ---
+def csv_writer_loop(row_queue, fd, write_failed):
+    """Formats and writes (timestamp, *floats) rows until a None sentinel arrives; sets write_failed on I/O errors."""
+    while True:
+        row = row_queue.get()
+        if row is None:
+            break
+        if write_failed.is_set():
+            continue # Drain the queue without touching the broken file
+        try:
+            # Unbuffered raw writes: nothing is left sitting in a Python buffer
+            scpi.write_all(fd, csv_row_format(*row).encode())
+        except Exception as e:
+            print(f"\nError writing to CSV file '{output_csv_file}': {e}")
+            write_failed.set()
+
+# --- Helper to drop an optional SCPI response header (":NUMERIC:NORMAL:VALUE 1.0,2.0" -> "1.0,2.0") ---
+def strip_header(response_part):
+    """Returns the data part of one query response, whether or not the instrument sends headers."""
+    response_part = response_part.strip()
+    if response_part.startswith(":") and " " in response_part:
+        return response_part.split(" ", 1)[1]
+    return response_part
+
+# --- Fallback for instruments that answer *OPC? before the integration timer expires: poll the state ---
+def poll_until_timeup(ser_conn, polling_start_time, software_timeout_seconds):
+    """Polls :INTEGRATE:STATE? until TIM/TIMEUP; raises on STOP/OVERFLOW or the software timeout."""
+    last_state_print_time = 0
+    while True:
+        current_time = time.monotonic()
+
+        # Check for software timeout first
+        if current_time - polling_start_time > software_timeout_seconds:
+            raise TimeoutError(f"Integration polling software timeout ({software_timeout_seconds:.1f}s) waiting for TIMEUP/TIM state.")
+
+        # Query state command (ALL CAPS)
+        if not scpi.write_cmd(ser_conn, CMD_STATE):
+            # If sending query fails, wait briefly and retry; the timeout check above ends the loop
+            print("Warning: Failed to send STATE query. Retrying...")
+            time.sleep(1.0)
+            continue
+
+        state_response = scpi.read_line(ser_conn)
+        if state_response is None:
+            # Read failed; scpi.read_line already waited for the port timeout
+            print("Warning: No response received for STATE query (read timeout). Retrying...")
+            continue
+
+        state_token = strip_header(state_response).upper()
+        state_action = STATE_MAP.get(state_token, "unknown")
+
+        # Optional: Print state less frequently to avoid spamming console
+        if current_time - last_state_print_time > 2.0: # Print state every 2 seconds
+            print(f"  Current state: {state_token} (Polling duration: {current_time - polling_start_time:.1f}s)")
+            last_state_print_time = current_time
+
+        if state_action == "done":
+            return state_token
+        elif state_action == "run":
+            time.sleep(0.4) # Poll slightly less frequently than 0.5s
+        elif state_action == "stop":
+            print(f"Error: Integration stopped unexpectedly. State: {state_token}")
+            raise Exception(f"Integration stopped unexpectedly: {state_token}")
+        elif state_action == "err":
+            print(f"Error: Integration overflow detected. State: {state_token}")
+            raise Exception(f"Integration overflow: {state_token}")
         else:
-            # print("Warning: Serial readline timed out (received no data).") # More verbose warning if needed
-            return None # Indicates timeout or no data
-    except serial.SerialException as e:
-        print(f"Error: Serial read error: {e}")
-        return None # Indicate error
-    except UnicodeDecodeError as e:
-        print(f"Error: Could not decode received bytes: {response_bytes}. Error: {e}")
-        return None # Indicate decode error
-    except Exception as e:
-        print(f"Error: Unexpected error during serial read: {e}")
-        return None # Indicate other error
+            print(f"Warning: Unexpected integration state received: {state_response}. Continuing to wait...")
+            time.sleep(0.5)
 
 # --- Connect and Configure Instrument ---
 try:
@@ -69,11 +135,13 @@ try:
     # Increase timeout slightly for potentially slower responses during configuration/polling
     ser = serial.Serial(port, baud_rate, timeout=2)
     print(f"Connected successfully to {port}.")
+    if scpi.set_low_latency(ser):
+        print("USB-serial latency timer set to 1 ms.")
+    scpi.set_buffer_sizes(ser)
     time.sleep(0.5) # Give the connection a moment to stabilize
 
     # Send *IDN? to verify connection (Standard queries often uppercase)
-    if not safe_serial_write(ser, "*IDN?\n"): raise Exception("Failed to send *IDN?")
-    idn_response = safe_serial_read(ser)
+    idn_response = scpi.query(ser, scpi.CMD_IDN)
     if idn_response:
         print(f"Instrument ID: {idn_response}")
         # Basic check if it looks like a Teledyne/LeCroy device (optional)
@@ -83,50 +151,34 @@ try:
         print("Warning: No response to *IDN?. Check connection/instrument state/permissions.")
         raise Exception("Failed to get IDN response")
 
-    # --- Configure Integration Settings ---
-    print("\nConfiguring Integration Settings...")
-    # Mode = STANdard (Timed) - Set command (mixed case)
-    if not safe_serial_write(ser, ":INTegrate:MODE STANdard\n"): raise Exception("Failed to set integrate mode")
-    # Function = WATT (for Watt-hours) - Set command (mixed case)
-    if not safe_serial_write(ser, ":INTegrate:FUNCtion WATT\n"): raise Exception("Failed to set integrate function")
-    # Timer Interval - Set command (mixed case)
-    h, m, s = seconds_to_hms(integration_interval_seconds)
-    timer_cmd = f":INTegrate:TIMer {h},{m},{s}\n"
-    print(f"Setting integration timer to {h}h {m}m {s}s ({integration_interval_seconds} seconds)")
-    if not safe_serial_write(ser, timer_cmd): raise Exception("Failed to set integrate timer")
-    time.sleep(0.2) # Extra delay after timer set
-
-    # Optional: Query settings to confirm (Query commands ALL CAPS)
-    if safe_serial_write(ser, ":INTEGRATE:MODE?\n"):
-        print(f"Confirm Mode: {safe_serial_read(ser)}")
-    if safe_serial_write(ser, ":INTEGRATE:FUNCTION?\n"):
-        print(f"Confirm Function: {safe_serial_read(ser)}")
-    if safe_serial_write(ser, ":INTEGRATE:TIMER?\n"):
-        print(f"Confirm Timer: {safe_serial_read(ser)}")
-
-
-    # --- Configure Numeric Items ---
-    # Item 1=UPPeak, Item 2=I, Item 3=P (instantaneous), Item 4=WH (integrated Watt-Hours)
-    # Set commands (mixed case)
-    print("\nConfiguring Numeric Items (1:Vpk, 2:I, 3:P_inst, 4:WH_int)...")
-    if not safe_serial_write(ser, ":NUMeric:NORMal:ITEM1 UPPeak\n"): raise Exception("Failed to set NUM ITEM1")
-    if not safe_serial_write(ser, ":NUMeric:NORMal:ITEM2 I\n"): raise Exception("Failed to set NUM ITEM2")
-    if not safe_serial_write(ser, ":NUMeric:NORMal:ITEM3 P\n"): raise Exception("Failed to set NUM ITEM3") # Keep instantaneous P as item 3
-    if not safe_serial_write(ser, ":NUMeric:NORMal:ITEM4 WH\n"): raise Exception("Failed to set NUM ITEM4") # Add total Watt-Hours as item 4
-
-    # Set number of items to return to 4 - Set command (mixed case)
-    if not safe_serial_write(ser, ":NUMeric:NORMal:NUMBer 4\n"): raise Exception("Failed to set NUM NUMBER")
-    # Confirm number of items - Query command (ALL CAPS)
-    if safe_serial_write(ser, ":NUMERIC:NORMAL:NUMBER?\n"):
-        print(f"Confirm Number of Items: {safe_serial_read(ser)}")
+    # --- Configure Integration Settings and Numeric Items ---
+    # scpi.configure sends everything as one semicolon-chained message ending in *OPC?
+    # Mode = STANdard (Timed), Function = WATT (for Watt-hours), Timer = integration interval
+    # Item 1=UPPeak, Item 2=I, Item 3=P (instantaneous), Item 4=WH (integrated Watt-Hours), 4 items returned
+    print("\nConfiguring Integration Settings and Numeric Items (1:Vpk, 2:I, 3:P_inst, 4:WH_int)...")
+    print(f"Setting integration timer to {TIMER_H}h {TIMER_M}m {TIMER_S}s ({integration_interval_seconds} seconds)")
+    integration_commands = (
+        ":INTegrate:MODE STANdard",
+        ":INTegrate:FUNCtion WATT",
+        TIMER_CMD,
+    )
+    if not scpi.configure(ser, ("UPPeak", "I", "P", "WH"), extra_commands=integration_commands):
+        raise Exception("No *OPC? response after configuration commands")
+
+    # Optional: Query settings to confirm (Query commands ALL CAPS) - debug only, one round-trip each
+    confirm_queries = (
+        ("Mode", ":INTEGRATE:MODE?\n"),
+        ("Function", ":INTEGRATE:FUNCTION?\n"),
+        ("Timer", ":INTEGRATE:TIMER?\n"),
+        ("Number of Items", ":NUMERIC:NORMAL:NUMBER?\n"),
+    )
+    if DEBUG_CONFIRM:
+        for label, confirm_query in confirm_queries:
+            print(f"Confirm {label}: {scpi.query(ser, confirm_query)}")
 
     # --- Disable Averaging (Optional - focus on Integration) ---
-    # print("\nSetting instantaneous averaging count to 1 (disabling averaging)")
-    # if not safe_serial_write(ser, ":MEASure:AVERaging:COUNt 1\n"): # Set command (mixed case)
-    #     print("Warning: Failed to disable averaging.")
-    # else:
-    #     if safe_serial_write(ser, ":MEASURE:AVERAGING:COUNT?\n"): # Query command (ALL CAPS)
-    #         print(f"Confirm Averaging Count: {safe_serial_read(ser)}")
+    # To disable instantaneous averaging, pass avg_count=1 to scpi.configure above and
+    # add ("Averaging Count", ":MEASURE:AVERAGING:COUNT?\n") to confirm_queries.
 
 
 except serial.SerialException as e:
@@ -144,158 +196,125 @@ except Exception as e:
 # --- Measurement Loop using Integration ---
 print(f"\nStarting Integration Loop. Interval: {integration_interval_seconds}s. Logging to '{output_csv_file}'...")
 
-csv_writer = None
-csv_file_handle = None
+csv_fd = None
+csv_queue = queue.Queue(maxsize=1024)
+csv_write_failed = threading.Event()
+csv_writer_thread = None
 
 try:
-    # Open CSV file and prepare writer
+    # Open CSV file for raw appends (O_BINARY keeps Windows from translating line endings)
     # Check if file exists to write header
     file_exists = os.path.exists(output_csv_file)
     file_is_empty = not file_exists or os.path.getsize(output_csv_file) == 0
 
-    # Use 'a' mode to append if exists, 'w' if not (though 'a' works for new files too)
-    csv_file_handle = open(output_csv_file, "a", newline='')
-    csv_writer = csv.writer(csv_file_handle)
+    csv_fd = os.open(output_csv_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
 
     if file_is_empty:
         print("CSV file is new or empty. Writing header.")
         # --- UPDATED CSV HEADER ---
-        csv_writer.writerow([
-            "Timestamp",
-            "Interval Avg Power (W)",
-            "Interval WattHours (Wh)",
-            "End Interval V+pk (V)",
-            "End Interval Current (A)",
-            "End Interval Inst Power (W)"
-        ])
-        csv_file_handle.flush() # Ensure header is written immediately
+        scpi.write_all(csv_fd, (
+            "Timestamp,"
+            "Interval Avg Power (W),"
+            "Interval WattHours (Wh),"
+            "End Interval V+pk (V),"
+            "End Interval Current (A),"
+            "End Interval Inst Power (W)\r\n"
+        ).encode())
+
+    # Ctrl+C already raises KeyboardInterrupt; route SIGTERM the same way so queued rows are not lost
+    signal.signal(signal.SIGTERM, handle_termination_signal)
+
+    csv_writer_thread = threading.Thread(
+        target=csv_writer_loop,
+        args=(csv_queue, csv_fd, csv_write_failed),
+        daemon=True,
+    )
+    csv_writer_thread.start()
 
     loop_count = 0
     while True:
         loop_count += 1
         print(f"\n--- Starting Integration Cycle {loop_count} ---")
-        integration_start_time = time.time()
+        integration_start_time = time.monotonic()
         cycle_error = False # Flag to track if an error occurred within this cycle
 
         try:
+            if csv_write_failed.is_set():
+                raise IOError("Background CSV writer failed")
+
             # 1. Reset Integrator - Set command (mixed case)
             print("Resetting integrator...")
-            if not safe_serial_write(ser, ":INTegrate:RESet\n"):
+            if not scpi.write_cmd(ser, CMD_RESET):
                 raise Exception("Failed to send RESET command")
-            time.sleep(0.3) # Give it a moment to reset
-
-            # 2. Start Integrator - Set command (mixed case)
-            print("Starting integrator...")
-            if not safe_serial_write(ser, ":INTegrate:STARt\n"):
-                 raise Exception("Failed to send START command")
-            time.sleep(0.1) # Small delay after start
+            if not scpi.sync(ser): # Wait for the reset to be processed
+                raise Exception("No *OPC? response after RESET command")
 
-            # 3. Wait for Integration to complete by polling state
-            print(f"Integrating for {integration_interval_seconds} seconds...")
-            polling_start_time = time.time()
+            # 2. Start Integrator and wait for it to finish - Set command (mixed case) chained with *OPC?
+            # A single blocking read replaces repeated :INTEGRATE:STATE? polling when the instrument
+            # holds the *OPC? reply until the timer expires; otherwise step 3 falls back to polling.
+            print(f"Starting integrator. Integrating for {integration_interval_seconds} seconds...")
             software_timeout_seconds = integration_interval_seconds * 1.5 + 5 # Base timeout + grace period
-            last_state_print_time = 0
-
-            while True:
-                current_time = time.time()
-
-                # Check for software timeout first
-                if current_time - polling_start_time > software_timeout_seconds:
-                    raise TimeoutError(f"Integration polling software timeout ({software_timeout_seconds:.1f}s) waiting for TIMEUP/TIM state.")
-
-                # Query state command (ALL CAPS)
-                if not safe_serial_write(ser, ":INTEGRATE:STATE?\n"):
-                    # If sending query fails, wait briefly and retry, but don't loop forever
-                    print("Warning: Failed to send STATE query. Retrying...")
-                    time.sleep(1.0)
-                    if time.time() - polling_start_time > software_timeout_seconds: # Recheck timeout after sleep
-                         raise TimeoutError(f"Integration polling software timeout ({software_timeout_seconds:.1f}s) after failing to send STATE query.")
-                    continue # Go back to start of while loop to retry write
-
-                # Read response
-                state_response = safe_serial_read(ser)
-
-                if state_response is None:
-                    # Read failed (e.g., timeout on readline)
-                    print("Warning: No response received for STATE query (read timeout). Retrying...")
-                    # No need to sleep here, safe_serial_read already waited for its timeout
-                    # Check timeout again immediately after failed read
-                    if time.time() - polling_start_time > software_timeout_seconds:
-                         raise TimeoutError(f"Integration polling software timeout ({software_timeout_seconds:.1f}s) after failing to read STATE response.")
-                    continue # Go back to start of while loop to retry query
-
-                # Process valid response
-                state_response_upper = state_response.upper()
-
-                # Optional: Print state less frequently to avoid spamming console
-                if current_time - last_state_print_time > 2.0: # Print state every 2 seconds
-                    print(f"  Current state: {state_response_upper} (Polling duration: {current_time - polling_start_time:.1f}s)")
-                    last_state_print_time = current_time
-
-                # --- CORRECTED STATE CHECKING ---
-                if "TIM" in state_response_upper or "TIMEUP" in state_response_upper: # Accept TIM or TIMEUP
-                    print(f"Integration complete ({state_response_upper}).")
-                    break # Exit the polling loop successfully
-                elif "RUN" in state_response_upper or "RUNNING" in state_response_upper: # Accept RUN or RUNNING
-                    # State is as expected (running), wait briefly and poll again
-                    time.sleep(0.4) # Poll slightly less frequently than 0.5s
-                elif "STOP" in state_response_upper or "RESET" in state_response_upper:
-                    print(f"Error: Integration stopped unexpectedly. State: {state_response_upper}")
-                    raise Exception(f"Integration stopped unexpectedly: {state_response_upper}")
-                elif "OVERFLOW" in state_response_upper:
-                     print(f"Error: Integration overflow detected. State: {state_response_upper}")
-                     raise Exception(f"Integration overflow: {state_response_upper}")
-                else:
-                    # Handle truly unexpected states if needed, otherwise just log and wait
-                    # Avoid flooding with warnings - maybe print only once per unique unexpected state?
-                    print(f"Warning: Unexpected integration state received: {state_response_upper}. Continuing to wait...")
-                    time.sleep(0.5)
-                # --- END CORRECTED STATE CHECKING ---
-
-            # End of polling loop (break was called)
-
-            # 4. Query the Numeric Values - Query command (ALL CAPS)
-            print("Querying measurement results...")
-            if not safe_serial_write(ser, ":NUMERIC:NORMAL:VALUE?\n"):
-                 raise Exception("Failed to send numeric query")
-
-            response = safe_serial_read(ser)
-
+            polling_start_time = time.monotonic()
+            # Let the read block for the whole integration
+            opc_response = scpi.query(ser, CMD_START, timeout=software_timeout_seconds)
+            if opc_response is None:
+                raise TimeoutError(f"Integration software timeout ({software_timeout_seconds:.1f}s) waiting for *OPC? after START.")
+
+            # 3. Read state + values in one round-trip and confirm the integrator finished by its timer
+            cycle_response = scpi.query(ser, CMD_STATE_AND_READ)
+            if cycle_response is None:
+                raise Exception("No response received for STATE/VALUE query")
+            if ";" not in cycle_response:
+                raise Exception(f"Unexpected response to STATE/VALUE query: '{cycle_response}'")
+            state_response, response = cycle_response.split(";", 1)
+            response = strip_header(response)
+
+            state_token = strip_header(state_response).upper()
+            state_action = STATE_MAP.get(state_token, "unknown")
+
+            if state_action not in ("done", "stop", "err"): # RUN/RUNNING or an unrecognised state
+                # Queries ran early: this instrument does not hold the reply for the integration timer.
+                # Keep the running integration, poll until it times up, then read fresh values.
+                # Values are only logged after a TIM/TIMEUP confirmation.
+                print(f"Integrator not finished ({state_token}); falling back to polling :INTEGRATE:STATE?...")
+                state_token = poll_until_timeup(ser, polling_start_time, software_timeout_seconds)
+                state_action = "done"
+                response = scpi.query(ser, scpi.CMD_READ)
+                response = strip_header(response) if response is not None else None
+
+            if state_action == "done": # Accept TIM or TIMEUP
+                print(f"Integration complete ({state_token}).")
+            elif state_action == "stop":
+                print(f"Error: Integration stopped unexpectedly. State: {state_token}")
+                raise Exception(f"Integration stopped unexpectedly: {state_token}")
+            elif state_action == "err":
+                 print(f"Error: Integration overflow detected. State: {state_token}")
+                 raise Exception(f"Integration overflow: {state_token}")
+
+            # 4. Parse the Numeric Values
             if response:
                 try:
-                    values = response.split(",")
+                    values = scpi.parse_float_list(response, empty_as_zero=True) # Empty fields read as 0.0
                     if len(values) >= 4:
-                        # Convert to float, handle potential conversion errors
-                        peak_voltage = float(values[0]) if values[0] else 0.0
-                        current = float(values[1]) if values[1] else 0.0
-                        instant_power = float(values[2]) if values[2] else 0.0
-                        watt_hours = float(values[3]) if values[3] else 0.0
+                        peak_voltage, current, instant_power, watt_hours = values[:4]
 
                         # 5. Calculate Average Power over the interval
-                        # Use the actual configured interval time for calculation
-                        interval_hours = integration_interval_seconds / 3600.0
-                        if interval_hours > 1e-9: # Avoid division by zero or near-zero
-                            average_power = watt_hours / interval_hours
-                        else:
-                            average_power = 0.0 # Or handle as error/undefined
+                        # Use the actual configured interval time (precomputed as 1/hours) for calculation
+                        average_power = watt_hours * INV_INTERVAL_HOURS
 
-                        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+                        timestamp = scpi.timestamp_now()
 
                         # Print to console
                         print(f"{timestamp} - Interval Avg P: {average_power:.4f} W (from {watt_hours:.6f} Wh)")
                         print(f"             End V+pk: {peak_voltage:.4f} V, End I: {current:.4f} A, End Inst P: {instant_power:.4f} W")
 
-                        # Write data row to CSV
-                        if csv_writer and csv_file_handle:
-                             csv_writer.writerow([
-                                timestamp,
-                                f"{average_power:.4f}",
-                                f"{watt_hours:.6f}",
-                                f"{peak_voltage:.4f}",
-                                f"{current:.4f}",
-                                f"{instant_power:.4f}"
-                            ])
-                             csv_file_handle.flush() # Ensure data is written to disk
+                        # Hand the raw data row to the background CSV writer (formats there, never blocks on disk)
+                        if csv_writer_thread and csv_writer_thread.is_alive():
+                            try:
+                                csv_queue.put_nowait((timestamp, average_power, watt_hours, peak_voltage, current, instant_power))
+                            except queue.Full:
+                                print("Error: CSV write queue is full; dropping this row.")
+                                cycle_error = True # Mark cycle as having an error
                         else:
                             print("Error: CSV file not available for writing.")
                             cycle_error = True # Mark cycle as having an error
@@ -360,9 +379,19 @@ except Exception as e:
 # --- Cleanup ---
 finally:
     print("\n--- Script Finalizing ---")
-    if csv_file_handle:
+    if csv_writer_thread and csv_writer_thread.is_alive():
+        print("Waiting for pending CSV rows to be written...")
+        try:
+            csv_queue.put(None, timeout=10) # Sentinel: writer exits after draining queued rows
+            csv_writer_thread.join(timeout=10)
+        except queue.Full:
+            pass # Writer is stuck on the disk; handled below
+    if csv_writer_thread and csv_writer_thread.is_alive():
+        # Closing now could let the writer hit a closed (or reused) descriptor; the OS closes it at exit
+        print(f"Warning: CSV writer is still busy; leaving '{output_csv_file}' open. Queued rows may be lost.")
+    elif csv_fd is not None:
         print(f"Closing CSV file: '{output_csv_file}'")
-        csv_file_handle.close()
+        os.close(csv_fd)
 
     if ser and ser.is_open:
         try:
@@ -370,11 +399,11 @@ finally:
             # Send STOP command (mixed case) - Best effort
             # Use a short timeout for this final command
             ser.timeout = 0.5 # Temporarily reduce timeout
-            if not safe_serial_write(ser, ":INTegrate:STOP\n"):
+            if not scpi.write_cmd(ser, CMD_STOP):
                 print("Warning: Could not send STOP command reliably.")
             else:
                 # Optionally read response if STOP sends one, otherwise just assume it worked
-                # stop_response = safe_serial_read(ser)
+                # stop_response = scpi.read_line(ser)
                 # print(f"Stop response (if any): {stop_response}")
                 pass
         except Exception as stop_e:
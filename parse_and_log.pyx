@@ -0,0 +1,74 @@
+# cython: language_level=3
+"""Optional compiled parse-and-format kernel for t3pm1006_avgAC.py.
+
+Build in place with:  cythonize -i parse_and_log.pyx
+The script falls back to its pure-Python parse_row() when this module is not built.
+"""
+from libc.stdlib cimport strtod
+
+cdef extern from "Python.h":
+    char* PyOS_double_to_string(double val, char format_code, int precision, int flags, int* ptype) except NULL
+    void PyMem_Free(void* p)
+    int Py_DTSF_ADD_DOT_0
+
+cdef bytes _float_repr(double value):
+    """Same text as Python's repr(float), as the pure-Python path writes."""
+    cdef char* text = PyOS_double_to_string(value, b'r', 0, Py_DTSF_ADD_DOT_0, NULL)
+    try:
+        return <bytes>text
+    finally:
+        PyMem_Free(text)
+
+cdef inline bint _is_space(char c):
+    """Whitespace float() strips around a number: C isspace() in the "C" locale."""
+    return c == b' ' or b'\t' <= c <= b'\r'
+
+def parse_row(str response, str timestamp):
+    """Parses "Vpk,I,P[,...]" and builds the CSV row; returns (peak_voltage, current, power, row_bytes) or None.
+
+    Accepts and rejects the same input as py_parse_row(): every field must be a float as float()
+    reads it, optionally surrounded by whitespace (empty fields, hex, nan(...) and trailing junk,
+    which strtod would otherwise accept or skip, raise ValueError), and fewer than 3 values returns
+    None. For valid input the row matches the pure-Python path byte for byte.
+    """
+    cdef bytes encoded = response.encode("ascii") # UnicodeEncodeError is a ValueError, like py_parse_row()
+    cdef const char* cursor = encoded
+    cdef const char* limit = cursor + len(encoded) # Embedded NULs must not end the parse early
+    cdef const char* scan
+    cdef char* end
+    cdef double value
+    cdef double values[3]
+    cdef int count = 0
+    if b"_" in encoded:
+        raise ValueError(f"unsupported characters in response: {response!r}") # float() takes digit separators, strtod does not
+    while True:
+        while cursor < limit and _is_space(cursor[0]):
+            cursor += 1
+        value = strtod(cursor, &end)
+        if end == cursor:
+            raise ValueError(f"could not convert field to float: {response!r}") # Empty or non-numeric field
+        scan = cursor
+        while scan != end:
+            if scan[0] == b'x' or scan[0] == b'X' or scan[0] == b'(':
+                raise ValueError(f"could not convert field to float: {response!r}") # Hex or nan(...) forms
+            scan += 1
+        cursor = end
+        while cursor < limit and _is_space(cursor[0]):
+            cursor += 1
+        if cursor < limit and cursor[0] != b',':
+            raise ValueError(f"could not convert field to float: {response!r}") # e.g. "3abc"
+        if count < 3:
+            values[count] = value
+        count += 1
+        if cursor == limit:
+            break
+        cursor += 1 # Skip the comma
+    if count < 3:
+        return None # Fewer than 3 values
+    row = b"".join((
+        timestamp.encode("ascii"), b",",
+        _float_repr(values[0]), b",",
+        _float_repr(values[1]), b",",
+        _float_repr(values[2]), b"\r\n",
+    ))
+    return values[0], values[1], values[2], row
@@ -0,0 +1,211 @@
+"""Shared SCPI-over-serial helpers for the Teledyne power analyser scripts."""
+import serial
+import time
+import os
+import sys
+import selectors
+
+# --- Pre-encoded SCPI commands shared by both scripts ---
+CMD_IDN = b"*IDN?\n"
+CMD_OPC = b"*OPC?\n"
+CMD_READ = b":NUMERIC:NORMAL:VALUE?\n"     # Query command (ALL CAPS)
+
+# --- Receive buffer: holds bytes read past the last complete line ---
+_rx_buf = bytearray()
+
+# --- Selector on the serial fd (POSIX only: Windows COM handles cannot be selected) ---
+_selector = None
+_selector_key = None # (serial object, fd) the selector is registered for
+_select_slice_seconds = 0.1 # Short waits keep Ctrl+C responsive during long reads
+
+# --- Function to lower the USB-serial latency timer (FTDI default is 16 ms per round-trip) ---
+def set_low_latency(ser_conn):
+    """Best-effort: sets the USB-serial latency timer to 1 ms. Returns True if applied."""
+    try:
+        if sys.platform.startswith("linux"):
+            tty_name = os.path.basename(os.path.realpath(ser_conn.port))
+            latency_path = f"/sys/bus/usb-serial/devices/{tty_name}/latency_timer"
+            if not os.path.exists(latency_path):
+                return False # Not a usb-serial device (e.g. CDC-ACM ttyACMx)
+            with open(latency_path, "w") as latency_file:
+                latency_file.write("1")
+            return True
+        elif sys.platform == "darwin":
+            import fcntl
+            import ctypes
+            IOSSDATALAT = 0x80085400 if ctypes.sizeof(ctypes.c_ulong) == 8 else 0x80045400 # _IOW('T', 0, unsigned long)
+            fcntl.ioctl(ser_conn.fd, IOSSDATALAT, ctypes.c_ulong(1))
+            return True
+    except Exception as e:
+        print(f"Warning: Could not set low latency on {ser_conn.port}: {e}")
+    return False
+
+# --- Function to enlarge driver buffers so long responses arrive in one read ---
+def set_buffer_sizes(ser_conn, rx_size=1 << 16, tx_size=1 << 12):
+    """Best-effort: enlarges the OS serial buffers. Returns True if applied.
+
+    Only Windows exposes this; POSIX tty buffers are sized by the kernel, so there is nothing to tune.
+    """
+    if os.name != "nt":
+        return False
+    try:
+        ser_conn.set_buffer_size(rx_size=rx_size, tx_size=tx_size)
+        return True
+    except Exception as e:
+        print(f"Warning: Could not adjust serial buffers on {ser_conn.port}: {e}")
+        return False
+
+# --- Function to safely write to serial and handle potential errors ---
+def write_cmd(ser_conn, command):
+    """Sends a command (str or pre-encoded bytes) to the serial port and handles potential write errors."""
+    command_bytes = command if isinstance(command, bytes) else command.encode()
+    try:
+        # print(f"SEND: {command_bytes.decode().strip()}") # Uncomment for debugging writes
+        ser_conn.write(command_bytes)
+        return True
+    except serial.SerialTimeoutException:
+        print(f"Error: Serial write timeout sending command: {command_bytes.decode().strip()}")
+        return False
+    except serial.SerialException as e:
+        print(f"Error: Serial write error sending command: {command_bytes.decode().strip()} - {e}")
+        return False
+    except Exception as e:
+        print(f"Error: Unexpected error sending command: {command_bytes.decode().strip()} - {e}")
+        return False
+
+# --- Function to wait for serial data in short select() slices ---
+def _wait_readable(ser_conn, deadline):
+    """Returns True once the port has data to read, or False when the deadline passes."""
+    global _selector, _selector_key
+    fd = ser_conn.fileno()
+    if _selector is None or _selector_key != (ser_conn, fd):
+        if _selector is not None:
+            _selector.close()
+        _selector = selectors.DefaultSelector()
+        _selector.register(fd, selectors.EVENT_READ)
+        _selector_key = (ser_conn, fd)
+    while not _selector.select(_select_slice_seconds):
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+    return True
+
+# --- Function to safely read from serial ---
+def read_line(ser_conn):
+    """Reads a line from the serial port, handling potential errors and timeouts.
+
+    Pulls everything the OS has buffered in one read() instead of pyserial's
+    byte-at-a-time readline(); bytes after the newline are kept for the next call.
+    """
+    response_bytes = b""
+    try:
+        deadline = time.monotonic() + ser_conn.timeout if ser_conn.timeout is not None else None
+        newline_index = _rx_buf.find(b"\n")
+        while newline_index < 0:
+            # On POSIX, wait in short select() slices rather than one long blocking read
+            if os.name != "nt" and not _wait_readable(ser_conn, deadline):
+                break # Timed out before a full line arrived
+            chunk = ser_conn.read(max(1, ser_conn.in_waiting))
+            if chunk:
+                search_from = len(_rx_buf)
+                _rx_buf.extend(chunk)
+                newline_index = _rx_buf.find(b"\n", search_from)
+            if newline_index < 0 and (not chunk or (deadline is not None and time.monotonic() >= deadline)):
+                break # Timed out before a full line arrived
+
+        if newline_index >= 0:
+            response_bytes = bytes(_rx_buf[:newline_index + 1])
+            del _rx_buf[:newline_index + 1]
+        else:
+            # Same as readline() on timeout: hand back whatever partial data arrived
+            response_bytes = bytes(_rx_buf)
+            _rx_buf.clear()
+
+        if response_bytes:
+            response_str = response_bytes.decode().strip()
+            # print(f"RECV: {response_str}") # Uncomment for debugging reads
+            return response_str
+        else:
+            # print("Warning: Serial readline timed out (received no data).") # More verbose warning if needed
+            return None # Indicates timeout or no data
+    except serial.SerialException as e:
+        print(f"Error: Serial read error: {e}")
+        return None # Indicate error
+    except UnicodeDecodeError as e:
+        print(f"Error: Could not decode received bytes: {response_bytes}. Error: {e}")
+        return None # Indicate decode error
+    except Exception as e:
+        print(f"Error: Unexpected error during serial read: {e}")
+        return None # Indicate other error
+
+# --- Function to discard any pending input (OS buffer and our receive buffer) ---
+def reset_rx(ser_conn):
+    """Drops unread bytes so the next read_line() starts from fresh data."""
+    ser_conn.reset_input_buffer()
+    _rx_buf.clear()
+
+# --- Function to send a query and read its one-line response ---
+def query(ser_conn, command, timeout=None):
+    """Sends a query and returns the response string, or None on write failure/timeout.
+
+    If timeout is given, the port timeout is raised/lowered for this read only.
+    """
+    if not write_cmd(ser_conn, command):
+        return None
+    if timeout is None:
+        return read_line(ser_conn)
+    previous_timeout = ser_conn.timeout
+    ser_conn.timeout = timeout
+    try:
+        return read_line(ser_conn)
+    finally:
+        ser_conn.timeout = previous_timeout
+
+# --- Function to parse a comma-separated numeric response ---
+def parse_float_list(response, empty_as_zero=False):
+    """Parses all comma-separated values into a list of floats; non-numeric fields raise ValueError.
+
+    Empty fields also raise unless empty_as_zero is set, in which case they read as 0.0.
+    """
+    if empty_as_zero:
+        return [float(v) if v else 0.0 for v in response.split(",")]
+    return [float(v) for v in response.split(",")]
+
+# --- Function to wait until the instrument has processed all previous commands ---
+def sync(ser_conn):
+    """Sends *OPC? and blocks until the instrument answers (instead of fixed sleeps)."""
+    return query(ser_conn, CMD_OPC) is not None
+
+# --- Function to apply numeric item (and other) settings in one chained message ---
+def configure(ser_conn, items, avg_count=None, extra_commands=()):
+    """Sets ITEM1..n to items, NUMBer to len(items) and optionally the averaging count.
+
+    extra_commands are prepended as-is. Everything goes out as one semicolon-chained
+    message (set commands mixed case) ending in *OPC?, so the instrument replies once
+    all settings are applied. Returns True if that reply arrived.
+    """
+    commands = list(extra_commands)
+    commands += [f":NUMeric:NORMal:ITEM{index} {item}" for index, item in enumerate(items, start=1)]
+    commands.append(f":NUMeric:NORMal:NUMBer {len(items)}")
+    if avg_count is not None:
+        commands.append(f":MEASure:AVERaging:COUNt {avg_count}")
+    commands.append("*OPC?")
+    return query(ser_conn, ";".join(commands) + "\n") is not None
+
+# --- Shared CSV helpers ---
+def write_all(fd, data):
+    """Writes all of data to fd, retrying after short writes (os.write may write only part of the buffer)."""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+_date_prefix = ""
+_date_key = None # (tm_year, tm_yday) the cached prefix belongs to
+
+def timestamp_now():
+    """Returns "YYYY-MM-DD HH:MM:SS" for now, formatting the date part only when the day changes."""
+    global _date_prefix, _date_key
+    now = time.localtime()
+    if (now.tm_year, now.tm_yday) != _date_key:
+        _date_prefix = time.strftime("%Y-%m-%d ", now)
+        _date_key = (now.tm_year, now.tm_yday)
+    return f"{_date_prefix}{now.tm_hour:02d}:{now.tm_min:02d}:{now.tm_sec:02d}"
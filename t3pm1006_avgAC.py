@@ -1,104 +1,97 @@
 import serial
 import time
-import csv
 import os # Import os module to check file existence easily
+import scpi
+try:
+    import parse_and_log # Optional compiled kernel, build with: cythonize -i parse_and_log.pyx
+except ImportError:
+    parse_and_log = None
 
 # --- Configuration ---
 port = "COM3"
 baud_rate = 115200
 averaging_count = 16  # Averaging level (1, 2, 4, 8, 16, 32, 64)
 output_csv_file = "power_data_averaged_peakV.csv" # Updated filename
+DEBUG_CONFIRM = False # Set True to read back and print instrument settings after configuration
+use_stream_mode = False # Set True to let the instrument push values instead of polling (falls back to polling if no valid line arrives)
+stream_start_cmd = ":NUMeric:NORMal:STARt 1\n" # <<< CHECK: device-specific continuous numeric output command
+stream_stop_cmd = ":NUMeric:NORMal:STARt 0\n"
+stream_read_timeout = 5 # Seconds to wait for a pushed line (must exceed the instrument's update interval)
 
 # --- Initialize Serial Connection Variable ---
 ser = None
+streaming = False # True once the instrument has been seen pushing values
+
+# --- Helper function to parse a response and build its CSV row (pure-Python fallback) ---
+def py_parse_row(response, timestamp):
+    """Parses "Vpk,I,P[,...]" and builds the CSV row; returns (peak_voltage, current, power, row_bytes) or None."""
+    if "_" in response or not response.isascii():
+        raise ValueError(f"unsupported characters in response: {response!r}") # Same input rules as the compiled kernel
+    values = scpi.parse_float_list(response)
+    if len(values) < 3:
+        return None
+    peak_voltage, current, power = values[:3]
+    # !r keeps the full float precision the csv module wrote
+    return peak_voltage, current, power, f"{timestamp},{peak_voltage!r},{current!r},{power!r}\r\n".encode()
+
+parse_row = parse_and_log.parse_row if parse_and_log else py_parse_row
 
 # --- Connect and Configure Instrument ---
 try:
     print(f"Attempting to connect to {port} at {baud_rate} baud...")
     ser = serial.Serial(port, baud_rate, timeout=1)
     print(f"Connected successfully to {port}.")
+    if scpi.set_low_latency(ser):
+        print("USB-serial latency timer set to 1 ms.")
+    scpi.set_buffer_sizes(ser)
 
     # Send *IDN? to verify connection and wake up instrument
-    ser.write("*IDN?\n".encode())
-    time.sleep(0.2)
-    idn_response = ser.readline().decode().strip()
+    idn_response = scpi.query(ser, scpi.CMD_IDN)
     if idn_response:
         print(f"Instrument ID: {idn_response}")
     else:
         print("Warning: No response to *IDN?. Check connection/instrument state.")
         # Consider exiting if IDN fails: raise Exception("Failed to get IDN response")
 
-    # --- NEW: Explicitly define the items to be returned ---
-    # We want Item 1 = UPPeak, Item 2 = I, Item 3 = P
-    # Using mixed case for set commands based on previous observations
-    print("Setting measurement items: 1=UPPeak, 2=I, 3=P...")
-    ser.write(":NUMeric:NORMal:ITEM1 UPPeak\n".encode()) # Set Item 1 to Positive Peak Voltage
-    time.sleep(0.2) # Allow time for processing
-    ser.write(":NUMeric:NORMal:ITEM2 I\n".encode())      # Set Item 2 to Current
-    time.sleep(0.2)
-    ser.write(":NUMeric:NORMal:ITEM3 P\n".encode())      # Set Item 3 to Active Power
-    time.sleep(0.2)
-
-    # Optional: Query items to confirm (using ALL CAPS for query)
-    print("Querying item settings for confirmation...")
-    ser.write(":NUMERIC:NORMAL:ITEM1?\n".encode())
-    time.sleep(0.1)
-    item1_resp = ser.readline().decode().strip()
-    print(f"Confirmation item 1: '{item1_resp}' (Expected :NUM:NORM:ITEM1 UPPE)") # Note: Instrument might abbreviate response
-    ser.write(":NUMERIC:NORMAL:ITEM2?\n".encode())
-    time.sleep(0.1)
-    item2_resp = ser.readline().decode().strip()
-    print(f"Confirmation item 2: '{item2_resp}' (Expected :NUM:NORM:ITEM2 I)")
-    ser.write(":NUMERIC:NORMAL:ITEM3?\n".encode())
-    time.sleep(0.1)
-    item3_resp = ser.readline().decode().strip()
-    print(f"Confirmation item 3: '{item3_resp}' (Expected :NUM:NORM:ITEM3 P)")
-    # --- End NEW section ---
-
-
-    # Now, manage the *number* of items returned (should be 3)
-    print("Checking/Setting number of items to return to 3...")
-    ser.write(":NUMERIC:NORMAL:NUMBER?\n".encode()) # Query first
-    time.sleep(0.1)
-    number_response_raw = ser.readline().decode().strip()
-    print(f"Response for NUMBER query: '{number_response_raw}'")
-    number_response_val = -1
-    if number_response_raw:
+    # --- Explicitly define the items to be returned, their number and the averaging count ---
+    # We want Item 1 = UPPeak, Item 2 = I, Item 3 = P, so :NUMeric:NORMal:NUMBer is set to 3
+    # scpi.configure sends everything as one chained message ending in *OPC?
+    print(f"Setting measurement items: 1=UPPeak, 2=I, 3=P (3 items), averaging count: {averaging_count}...")
+    if not scpi.configure(ser, ("UPPeak", "I", "P"), averaging_count):
+        raise Exception("No *OPC? response after configuration commands")
+
+    # Optional: Query settings to confirm (using ALL CAPS for query) - debug only, one round-trip each
+    # Note: Instrument might abbreviate responses
+    confirm_queries = (
+        ("item 1", ":NUMERIC:NORMAL:ITEM1?\n", ":NUM:NORM:ITEM1 UPPE"),
+        ("item 2", ":NUMERIC:NORMAL:ITEM2?\n", ":NUM:NORM:ITEM2 I"),
+        ("item 3", ":NUMERIC:NORMAL:ITEM3?\n", ":NUM:NORM:ITEM3 P"),
+        ("number of items", ":NUMERIC:NORMAL:NUMBER?\n", "3"),
+        ("averaging count", ":MEASURE:AVERAGING:COUNT?\n", str(averaging_count)),
+    )
+    if DEBUG_CONFIRM:
+        print("Querying settings for confirmation...")
+        for label, confirm_query, expected in confirm_queries:
+            print(f"Confirmation {label}: '{scpi.query(ser, confirm_query)}' (Expected {expected})")
+
+    # --- Switch to instrument-driven output, if supported ---
+    # The first pushed line proves streaming works only if it parses as a measurement; it is discarded as a probe
+    if use_stream_mode:
+        print("Enabling continuous numeric output...")
+        probe_response = scpi.query(ser, stream_start_cmd, timeout=stream_read_timeout)
         try:
-            number_response_val = int(number_response_raw.split()[-1])
-            print(f"Current number of items reported: {number_response_val}")
-        except (IndexError, ValueError):
-            print(f"Could not parse number of items from response: '{number_response_raw}'")
-    else:
-        print("Warning: No response received for :NUMERIC:NORMAL:NUMBER? query.")
-
-    # Set number of items if not already 3
-    if number_response_val != 3:
-        print("Setting number of items to 3...")
-        ser.write(":NUMeric:NORMal:NUMBer 3\n".encode()) # Set command
-        time.sleep(0.2)
-        # Confirm the change
-        ser.write(":NUMERIC:NORMAL:NUMBER?\n".encode()) # Query again
-        time.sleep(0.1)
-        confirm_response = ser.readline().decode().strip()
-        print(f"Confirmation response after setting NUMBER: '{confirm_response}'")
-    else:
-        print("Number of items is already 3.")
-
-
-    # Set Averaging Count (using mixed case for set command)
-    print(f"Setting averaging count to: {averaging_count}")
-    ser.write(f":MEASure:AVERaging:COUNt {averaging_count}\n".encode())
-    time.sleep(0.2)
-
-    # Confirm the averaging setting (using ALL CAPS for query)
-    ser.write(":MEASURE:AVERAGING:COUNT?\n".encode())
-    time.sleep(0.1)
-    avg_response = ser.readline().decode().strip()
-    if avg_response:
-        print(f"Averaging count confirmation response: '{avg_response}'")
-    else:
-         print("Warning: No response received for :MEASURE:AVERAGING:COUNT? query.")
+            probe_ok = probe_response is not None and len(scpi.parse_float_list(probe_response)) >= 3
+        except ValueError:
+            probe_ok = False # e.g. an error message instead of numeric data
+        if probe_ok:
+            streaming = True
+            ser.timeout = stream_read_timeout
+            print("Instrument is streaming values; no per-sample queries will be sent.")
+        else:
+            print(f"Warning: No streamed data received (got '{probe_response}'). Falling back to polling :NUMERIC:NORMAL:VALUE? every second.")
+            scpi.write_cmd(ser, stream_stop_cmd)
+            time.sleep(0.5) # Let any line already in flight arrive before discarding it
+            scpi.reset_rx(ser) # Otherwise late pushed lines would be read as answers to VALUE?
 
 
 except serial.SerialException as e:
@@ -115,66 +108,70 @@ except Exception as e:
 
 # --- Measurement Loop and CSV Logging ---
 print(f"\nStarting measurement loop. Logging data to '{output_csv_file}'...")
+if parse_and_log is None:
+    print("Note: compiled parse_and_log kernel not built; using the Python parser.")
+
+csv_fd = None
 
 try:
-    with open(output_csv_file, "a", newline='') as csvfile:
-        writer = csv.writer(csvfile)
-
-        file_is_empty = os.path.getsize(output_csv_file) == 0 if os.path.exists(output_csv_file) else True
-
-        if file_is_empty:
-            print("CSV file is new or empty. Writing header.")
-            # --- UPDATED CSV HEADER ---
-            writer.writerow(["Timestamp", "Avg Peak Voltage (V+pk)", "Avg Current (A)", "Avg Power (W)"])
-            csvfile.flush()
-
-        while True:
-            try:
-                # Query measurements (Items 1, 2, 3 are now UPPeak, I, P)
-                ser.write(":NUMERIC:NORMAL:VALUE?\n".encode()) # Query is ALL CAPS
-                response = ser.readline().decode().strip()
-
-                if response:
-                    try:
-                        values = response.split(",")
-                        if len(values) >= 3:
-                            # Parse the values
-                            peak_voltage = float(values[0]) # Value 1 is now UPPeak
-                            current = float(values[1])      # Value 2 is I
-                            power = float(values[2])        # Value 3 is P
-                            timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-
-                            # --- UPDATED PRINT STATEMENT ---
-                            print(f"{timestamp} - Avg V+pk: {peak_voltage:.4f} V, Avg I: {current:.4f} A, Avg P: {power:.4f} W")
-
-                            # Write data row to CSV (using updated labels implicitly via header)
-                            writer.writerow([timestamp, peak_voltage, current, power])
-                            csvfile.flush()
-
-                        else:
-                            print(f"Warning: Received unexpected number of values: {len(values)}. Response: '{response}'")
-
-                    except (ValueError, IndexError) as e:
-                        print(f"Error parsing response: '{response}'. Error: {e}")
-                    except Exception as e:
-                         print(f"An unexpected error occurred during data processing/writing: {e}")
-
-                else:
-                    print("Warning: No measurement response received from instrument in this cycle.")
-
-                time.sleep(1) # Poll every second
-
-            except serial.SerialException as e:
-                print(f"\nSerial communication error during loop: {e}")
-                print("Exiting measurement loop due to serial error.")
-                break
-            except IOError as e:
-                 print(f"\nError writing to CSV file '{output_csv_file}': {e}")
-                 print("Exiting measurement loop due to file error.")
-                 break
-            except Exception as e:
-                print(f"\nAn unexpected error occurred in the measurement loop: {e}")
-                break
+    file_is_empty = os.path.getsize(output_csv_file) == 0 if os.path.exists(output_csv_file) else True
+
+    # Open CSV file for raw appends (O_BINARY keeps Windows from translating line endings)
+    csv_fd = os.open(output_csv_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+
+    if file_is_empty:
+        print("CSV file is new or empty. Writing header.")
+        # --- UPDATED CSV HEADER ---
+        scpi.write_all(csv_fd, b"Timestamp,Avg Peak Voltage (V+pk),Avg Current (A),Avg Power (W)\r\n")
+
+    while True:
+        try:
+            # Read measurements (Items 1, 2, 3 are now UPPeak, I, P)
+            if streaming:
+                # Instrument pushes one line per update; no write needed
+                response = scpi.read_line(ser)
+            else:
+                response = scpi.query(ser, scpi.CMD_READ)
+
+            if response:
+                try:
+                    timestamp = scpi.timestamp_now()
+                    # Value 1 is UPPeak, Value 2 is I, Value 3 is P (parsed here so a malformed line only skips this sample)
+                    parsed = parse_row(response, timestamp)
+                    if parsed is not None:
+                        peak_voltage, current, power, row_bytes = parsed
+
+                        # --- UPDATED PRINT STATEMENT ---
+                        print(f"{timestamp} - Avg V+pk: {peak_voltage:.4f} V, Avg I: {current:.4f} A, Avg P: {power:.4f} W")
+
+                        # Write data row to CSV (using updated labels implicitly via header), one buffer per row
+                        scpi.write_all(csv_fd, row_bytes)
+
+                    else:
+                        print(f"Warning: Received fewer than 3 values. Response: '{response}'")
+
+                except (ValueError, IndexError) as e:
+                    print(f"Error parsing response: '{response}'. Error: {e}")
+                except Exception as e:
+                     print(f"An unexpected error occurred during data processing/writing: {e}")
+
+            else:
+                print("Warning: No measurement response received from instrument in this cycle.")
+
+            if not streaming:
+                time.sleep(1) # Poll every second (streaming is paced by the instrument)
+
+        except serial.SerialException as e:
+            print(f"\nSerial communication error during loop: {e}")
+            print("Exiting measurement loop due to serial error.")
+            break
+        except IOError as e:
+             print(f"\nError writing to CSV file '{output_csv_file}': {e}")
+             print("Exiting measurement loop due to file error.")
+             break
+        except Exception as e:
+            print(f"\nAn unexpected error occurred in the measurement loop: {e}")
+            break
 
 # --- Cleanup ---
 except KeyboardInterrupt:
@@ -182,7 +179,12 @@ except KeyboardInterrupt:
 except IOError as e:
     print(f"Fatal Error: Could not open or write to CSV file '{output_csv_file}': {e}")
 finally:
+    if csv_fd is not None:
+        os.close(csv_fd)
     if ser and ser.is_open:
+        if streaming:
+            print("Stopping continuous numeric output.")
+            scpi.write_cmd(ser, stream_stop_cmd)
         print("Closing serial port.")
         ser.close()
     print("Script finished.")